@@ -9,7 +9,7 @@ class Country(Enum):
     CANADA = "ca"
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Address:
     """Descriptor of a North American street address."""
 
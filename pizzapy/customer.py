@@ -2,7 +2,7 @@ from dataclasses import dataclass
 from .address import Address
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Customer:
     """Information about user who orders a pizza."""
 
@@ -1,228 +1,535 @@
-from collections.abc import Generator
+from collections.abc import Callable, Generator, Iterable
+import contextlib
+import functools
+from http import HTTPStatus
+import os
 import re
-from enum import Enum
-from json import JSONDecodeError
-from typing import Any
+import tempfile
+import threading
+from pathlib import Path
+from types import ModuleType, TracebackType
+from typing import TYPE_CHECKING, Any, NamedTuple, Self
 
-import httpx
-import structlog
+import msgspec
+import simdjson
 
 from pizzapy.address import Address
 from pizzapy.coupon import Coupon
 from pizzapy.menu import Menu, MenuCategory, MenuCoupon, MenuLineItem, MenuProduct
 from pizzapy.store import PickupType, Store
 
-logger = structlog.stdlib.get_logger(__name__)
+if TYPE_CHECKING:
+    import httpx
+    import structlog
 
 
-class DominosApiEndpoints(Enum):
-    """Collection of valid Dominos API endpoint URLs"""
+# httpx (ssl, h11, h2, certifi) and structlog are comparatively slow to import,
+# so they are only loaded once a connector is created or something is logged.
+@functools.cache
+def _get_httpx() -> ModuleType:
+    import httpx
 
-    FIND_STORE = "https://order.dominos.com/power/store-locator?s={address_line_one}&c={address_line_two}&type={pickup_type}"
-    GET_MENU = (
-        "https://order.dominos.com/power/store/{store_id}/menu?lang=en&structured=true"
-    )
+    return httpx
+
+
+@functools.cache
+def _get_logger() -> "structlog.stdlib.BoundLogger":
+    import structlog
+
+    return structlog.stdlib.get_logger(__name__)
+
+
+def _client_options() -> dict[str, Any]:
+    # Shared by the sync and async clients so their settings cannot drift.
+    httpx = _get_httpx()
+    return {
+        "http2": True,
+        "limits": httpx.Limits(max_keepalive_connections=4, keepalive_expiry=30),
+        "timeout": 10.0,
+    }
+
+
+# Dominos API endpoint URLs.
+FIND_STORE_URL = "https://order.dominos.com/power/store-locator"
+MENU_URL_TEMPLATE = (
+    "https://order.dominos.com/power/store/{store_id}/menu?lang=en&structured=true"
+)
+
+# Matches a price already spelled out in a coupon name, e.g. "$7.99".
+_PRICE_RE = re.compile(r"\$\d{1,2}\.\d{2}")
+
+
+class _RawStoreAddress(msgspec.Struct):
+    Street: str
+    City: str
+    Region: str
+    PostalCode: int
+
+
+class _RawStore(msgspec.Struct):
+    """Shape of a single store in the store locator response."""
+
+    StoreID: int
+    Address: _RawStoreAddress
+    IsOnlineNow: bool = False
+    ServiceIsOpen: dict[str, bool] = {}
+
+
+class _RawStoreLocatorResponse(msgspec.Struct):
+    # Stores are kept raw and decoded one by one, so a single malformed entry
+    # can be reported on its own instead of failing the whole response.
+    Stores: list[msgspec.Raw] = []
+
+
+_STORE_LOCATOR_DECODER = msgspec.json.Decoder(_RawStoreLocatorResponse)
+# Dominos sends numbers such as StoreID and PostalCode as strings; non-strict
+# mode lets msgspec coerce them while decoding.
+_STORE_DECODER = msgspec.json.Decoder(_RawStore, strict=False)
+
+
+class _RawStoreId(msgspec.Struct):
+    StoreID: str | int | None = None
+
+
+_STORE_ID_DECODER = msgspec.json.Decoder(_RawStoreId)
+
+
+def _raw_store_id(raw_store: msgspec.Raw) -> str | int | None:
+    # Used when logging a store that failed to decode, so the event only
+    # carries its ID rather than the whole raw store.
+    try:
+        return _STORE_ID_DECODER.decode(raw_store).StoreID
+    except msgspec.DecodeError:
+        return None
+
+
+class _MenuRequest(NamedTuple):
+    url: str
+    headers: dict[str, str]
 
 
 class DominosApiConnector:
     """Interface connections to the Dominos API."""
 
+    def __init__(self, cache_dir: Path | None = None) -> None:
+        # When set, menus are cached here and revalidated with their ETag.
+        self._cache_dir = cache_dir
+        # simdjson reuses its internal buffers between documents, so a single
+        # parser is kept around for the (large) menu payloads.
+        self._parser = simdjson.Parser()
+        self._parser_lock = threading.Lock()
+        # One long-lived client so consecutive calls (store lookup, then menu)
+        # reuse the pooled connection instead of handshaking every time.
+        self._client = _get_httpx().Client(**_client_options())
+
+    def close(self) -> None:
+        self._client.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
     def get_nearest_stores(
         self, address: Address, pickup_type: PickupType
     ) -> Generator[Store]:
-        endpoint = DominosApiEndpoints.FIND_STORE
-        url = endpoint.value.format(
-            address_line_one=address.line_one,
-            address_line_two=address.line_two,
-            pickup_type=pickup_type.value,
+        params = self._store_locator_params(address, pickup_type)
+        response = self._client.get(FIND_STORE_URL, params=params)
+        yield from self._parse_stores(response, address, pickup_type)
+
+    async def get_nearest_stores_async(
+        self, address: Address, pickup_type: PickupType
+    ) -> list[Store]:
+        params = self._store_locator_params(address, pickup_type)
+        async with self._new_async_client() as client:
+            response = await client.get(FIND_STORE_URL, params=params)
+        return list(self._parse_stores(response, address, pickup_type))
+
+    def get_store_closest_to_address(
+        self, address: Address, pickup_type: PickupType
+    ) -> Store | None:
+        for store in self.get_nearest_stores(address, pickup_type):
+            if store.is_available:
+                return store
+        return None
+
+    def get_menu_for_store(self, store: Store) -> Menu | None:
+        steps = self._fetch_menu(store)
+        try:
+            step = next(steps)
+            while True:
+                if isinstance(step, _MenuRequest):
+                    step = steps.send(self._client.get(step.url, headers=step.headers))
+                else:
+                    # The cache write holds the response and body, so it is
+                    # dropped before the generator resumes.
+                    result = step()
+                    del step
+                    step = steps.send(result)
+        except StopIteration as stop:
+            sections = stop.value
+        return None if sections is None else self._parse_menu(sections)
+
+    async def get_menu_for_store_async(self, store: Store) -> Menu | None:
+        async with self._new_async_client() as client:
+            return await self._get_menu_for_store_async(client, store)
+
+    async def get_menus_for_stores(self, stores: Iterable[Store]) -> list[Menu | None]:
+        # Only needed here; callers of the async API already have asyncio loaded.
+        import asyncio
+
+        async with self._new_async_client() as client:
+            return await asyncio.gather(
+                *(self._get_menu_for_store_async(client, store) for store in stores)
+            )
+
+    def _new_async_client(self) -> "httpx.AsyncClient":
+        # Async clients hold connections bound to the event loop that opened
+        # them, so one is created per call (inside the running loop) rather
+        # than kept on the connector.
+        return _get_httpx().AsyncClient(**_client_options())
+
+    async def _get_menu_for_store_async(
+        self, client: "httpx.AsyncClient", store: Store
+    ) -> Menu | None:
+        import asyncio
+
+        steps = self._fetch_menu(store)
+        try:
+            step = next(steps)
+            while True:
+                if isinstance(step, _MenuRequest):
+                    step = steps.send(await client.get(step.url, headers=step.headers))
+                else:
+                    # Cache file access is blocking, so it runs off the loop.
+                    result = await asyncio.to_thread(step)
+                    del step
+                    step = steps.send(result)
+        except StopIteration as stop:
+            sections = stop.value
+        return None if sections is None else self._parse_menu(sections)
+
+    def _fetch_menu(
+        self, store: Store
+    ) -> Generator["_MenuRequest | Callable[[], Any]", Any, dict[str, Any] | None]:
+        # The menu fetch, cache revalidation and decoding shared by the sync
+        # and async paths. It yields a _MenuRequest for every HTTP request and
+        # a callable for every blocking cache operation, and is sent back the
+        # response or the callable's result. It returns the decoded sections
+        # rather than the Menu so the callers build the Menu only once this
+        # frame, and with it the response and raw body, is gone.
+        url = MENU_URL_TEMPLATE.format(store_id=store.id_)
+        use_cache = self._cache_dir is not None
+        headers = (
+            (yield functools.partial(self._menu_cache_headers, store))
+            if use_cache
+            else {}
+        )
+        response = yield _MenuRequest(url, headers)
+        content = None
+        if response.status_code == HTTPStatus.NOT_MODIFIED:
+            content = yield functools.partial(self._read_cached_menu, store)
+            if content is None:
+                # The cache entry disappeared after the request was sent.
+                response = yield _MenuRequest(url, {})
+        if content is None:
+            content = response.content
+
+        sections = self._decode_menu(content, url)
+        if sections is None:
+            return None
+        if use_cache:
+            yield functools.partial(self._write_cached_menu, store, response, content)
+        del content, response
+        return sections
+
+    @staticmethod
+    def _menu_cache_paths(cache_dir: Path, store: Store) -> tuple[Path, Path]:
+        return (
+            cache_dir / f"menu_{store.id_}.json",
+            cache_dir / f"menu_{store.id_}.etag",
         )
-        with httpx.Client() as client:
-            response = client.get(url)
 
+    def _menu_cache_headers(self, store: Store) -> dict[str, str]:
+        if self._cache_dir is None:
+            return {}
+        menu_path, etag_path = self._menu_cache_paths(self._cache_dir, store)
         try:
-            data = response.json()
-        except JSONDecodeError:
-            logger.error("Failed to parse JSON from Dominos", response=response)
-            return
+            etag = etag_path.read_text()
+        except OSError:
+            # Missing, unreadable, or the cache dir is not a directory.
+            return {}
+        if not menu_path.is_file():
+            return {}
+        return {"If-None-Match": etag}
+
+    def _read_cached_menu(self, store: Store) -> bytes | None:
+        if self._cache_dir is None:
+            return None
+        menu_path, _ = self._menu_cache_paths(self._cache_dir, store)
+        try:
+            return menu_path.read_bytes()
+        except OSError:
+            return None
 
-        stores = data.get("Stores", [])
-        if not stores:
-            logger.warning("No stores found near address", address=address)
+    def _write_cached_menu(
+        self, store: Store, response: "httpx.Response", content: bytes
+    ) -> None:
+        etag = response.headers.get("ETag")
+        if self._cache_dir is None or not response.is_success or not etag:
             return
+        menu_path, etag_path = self._menu_cache_paths(self._cache_dir, store)
+        try:
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+            # Remove the old ETag first and write the new one last, so a
+            # partial update never pairs an ETag with a body it does not
+            # belong to.
+            etag_path.unlink(missing_ok=True)
+            self._replace_file(menu_path, content)
+            self._replace_file(etag_path, etag.encode())
+        except OSError as e:
+            # The menu was fetched fine; a cache that cannot be written only
+            # costs a full download next time.
+            _get_logger().warning(
+                "Could not write menu cache", store_id=store.id_, error=str(e)
+            )
 
-        for store in stores:
-            store_address = store.get("Address", {})
-            if not store_address:
-                logger.warning("Could not parse store address", raw_store=store)
-                return None
+    @staticmethod
+    def _replace_file(path: Path, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            try:
+                f = os.fdopen(fd, "wb")
+            except BaseException:
+                os.close(fd)
+                raise
+            with f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def _store_locator_params(
+        address: Address, pickup_type: PickupType
+    ) -> dict[str, str]:
+        # Passed as query params so httpx takes care of URL-encoding the
+        # address (street names may contain "&", "#", etc).
+        return {"s": address.line_one, "c": address.line_two, "type": pickup_type.value}
+
+    def _parse_stores(
+        self, response: "httpx.Response", address: Address, pickup_type: PickupType
+    ) -> Generator[Store]:
+        try:
+            stores = _STORE_LOCATOR_DECODER.decode(response.content).Stores
+        except msgspec.DecodeError:
+            _get_logger().error("Failed to parse JSON from Dominos", response=response)
+            return
 
-            store_address_street = store_address.get("Street", None)
-            store_address_city = store_address.get("City", None)
-            store_address_region = store_address.get("Region", None)
-            store_address_postal_code = store_address.get("PostalCode", None)
-
-            if not any(
-                (
-                    store_address_street,
-                    store_address_city,
-                    store_address_region,
-                    store_address_postal_code,
-                )
-            ):
-                logger.warning("Could not parse store address", raw_store=store)
-                return None
+        if not stores:
+            _get_logger().warning("No stores found near address", address=address)
+            return
 
+        for raw_store in stores:
             try:
-                postal_code = int(store_address_postal_code)
-                id_ = int(store.get("StoreID", None))
-            except ValueError:
-                logger.error(
-                    "Failed to convert number strings to integers",
-                    raw_store=store,
+                store = _STORE_DECODER.decode(raw_store)
+            except msgspec.ValidationError as e:
+                _get_logger().warning(
+                    "Could not parse store",
+                    store_id=_raw_store_id(raw_store),
+                    error=str(e),
                 )
-                return None
-
-            is_available = store.get("IsOnlineNow", False) and store.get(
-                "ServiceIsOpen", {}
-            ).get(pickup_type.value, False)
+                continue
 
+            store_address = store.Address
             yield Store(
-                id_=id_,
+                id_=store.StoreID,
                 address=Address(
-                    street=store_address_street,
-                    city=store_address_city,
-                    region=store_address_region,
-                    postal_code=postal_code,
+                    street=store_address.Street,
+                    city=store_address.City,
+                    region=store_address.Region,
+                    postal_code=store_address.PostalCode,
                 ),
-                is_available=is_available,
+                is_available=store.IsOnlineNow
+                and store.ServiceIsOpen.get(pickup_type.value, False),
             )
 
-    def get_store_closest_to_address(
-        self, address: Address, pickup_type: PickupType
-    ) -> Store | None:
-        for store in self.get_nearest_stores(address, pickup_type):
-            if store.is_available:
-                return store
-        return None
+    def _decode_menu(self, content: bytes, url: str) -> dict[str, Any] | None:
+        # A simdjson parser holds one document at a time, so parsing and
+        # pulling out the sections are serialised across threads, and the
+        # document is released before the lock is.
+        with self._parser_lock:
+            try:
+                document = self._parser.parse(content)
+            except ValueError:
+                _get_logger().error("Failed to parse JSON from Dominos", url=url)
+                return None
 
-    def get_menu_for_store(self, store: Store) -> Menu | None:
-        endpoint = DominosApiEndpoints.GET_MENU
-        url = endpoint.value.format(store_id=store.id_)
-        with httpx.Client() as client:
-            response = client.get(url)
+            if not isinstance(document, simdjson.Object):
+                del document
+                _get_logger().error("Unexpected menu document from Dominos", url=url)
+                return None
 
+            sections = {
+                "categories": self._get_menu_section(
+                    document, "/Categorization/Food/Categories", []
+                ),
+                "products": self._get_menu_section(document, "/Products", {}),
+                "variants": self._get_menu_section(document, "/Variants", {}),
+                "coupons": self._get_menu_section(document, "/Coupons", {}),
+            }
+            del document
+        return sections
+
+    @staticmethod
+    def _get_menu_section(document: simdjson.Object, pointer: str, default: Any) -> Any:
+        # Only the sections the menu is built from are converted to Python
+        # objects; the rest of the document stays on simdjson's tape.
         try:
-            data = response.json()
-        except JSONDecodeError:
-            logger.error(
-                "Failed to parse JSON from Dominos", response=response, url=response.url
-            )
-            return None
-
-        categories: list[dict[str, Any]] = (
-            data.get("Categorization", {}).get("Food", {}).get("Categories", [])
-        )
-        products: dict[str, dict[str, Any]] = data.get("Products", {})
-        variants = data.get("Variants", {})
-        coupons = data.get("Coupons", {})
+            section = document.at_pointer(pointer)
+        except (KeyError, TypeError, IndexError, ValueError):
+            # Missing key, or a node on the path has the wrong type.
+            return default
+
+        if isinstance(default, dict) and isinstance(section, simdjson.Object):
+            return section.as_dict()
+        if isinstance(default, list) and isinstance(section, simdjson.Array):
+            return section.as_list()
+        return default
+
+    def _parse_menu(self, sections: dict[str, Any]) -> Menu | None:
+        categories: list[dict[str, Any]] = sections["categories"]
+        products: dict[str, dict[str, Any]] = sections["products"]
+        variants = sections["variants"]
+        coupons = sections["coupons"]
 
         if not any((categories, products, variants, coupons)):
-            logger.error("Could not parse menu", raw_menu=data)
+            _get_logger().error("Could not parse menu")
             return None
 
-        parsed_categories = self._parse_categories(categories)
-        parsed_products = self._parse_products(products)
-        parsed_line_items = self._parse_line_items(variants)
-        parsed_coupons = self._parse_coupons(coupons)
-
         return Menu(
-            categories=list(parsed_categories),
-            products=list(parsed_products),
-            line_items=list(parsed_line_items),
-            coupons=list(parsed_coupons),
+            categories=tuple(self._parse_categories(categories)),
+            products=tuple(self._parse_products(products)),
+            line_items=tuple(self._parse_line_items(variants)),
+            coupons=tuple(self._parse_coupons(coupons)),
         )
 
-    def _parse_categories(self, data: list[dict[str, Any]]) -> Generator[MenuCategory]:
-        def get_all_product_codes_from_category(data: dict[str, Any]) -> Generator[str]:
-            if not {"Categories", "Code", "Name", "Description", "Products"}.issubset(
-                data.keys()
-            ):
-                logger.error("Incorrect menu category format", data=data)
-                return
-
-            categories = data.get("Categories", [])
-            products = data.get("Products", [])
-
-            if not products:
-                for subcategory in categories:
-                    yield from get_all_product_codes_from_category(subcategory)
-
-            yield from products
-
+    def _parse_categories(self, data: list[dict[str, Any]]) -> list[MenuCategory]:
+        def get_all_product_codes_from_category(data: dict[str, Any]) -> list[str]:
+            # Walk the category tree with an explicit stack; only leaf
+            # categories (those listing products) contribute codes.
+            product_codes: list[str] = []
+            stack = [data]
+            while stack:
+                current = stack.pop()
+                products = current["Products"]
+                if products:
+                    product_codes.extend(products)
+                else:
+                    stack.extend(current["Categories"])
+            return product_codes
+
+        parsed: list[MenuCategory] = []
         for category in data:
-            if not {"Categories", "Code", "Name", "Description", "Products"}.issubset(
-                category.keys()
-            ):
-                logger.error("Incorrect menu category format", data=category)
-                return
-
-            product_codes = set(get_all_product_codes_from_category(category))
-            code = category.get("Code", "")
-            name = category.get("Name", "")
-            description = category.get("Description", "")
+            try:
+                code = category["Code"]
+                name = category["Name"]
+                description = category["Description"]
+                # Malformed subcategories surface here as well.
+                product_codes = frozenset(get_all_product_codes_from_category(category))
+            except (KeyError, TypeError):
+                # Missing keys, or a category/subcategory that is not an object.
+                _get_logger().error(
+                    "Incorrect menu category format",
+                    code=category.get("Code") if isinstance(category, dict) else None,
+                )
+                continue
 
             if not any((product_codes, code, name, description)):
-                logger.error("Could not parse menu category data", raw_data=data)
-
-            yield MenuCategory(
-                code=code, name=name, description=description, products=product_codes
+                _get_logger().error("Could not parse menu category data", code=code)
+
+            parsed.append(
+                MenuCategory(
+                    code=code,
+                    name=name,
+                    description=description,
+                    products=product_codes,
+                )
             )
+        return parsed
 
-    def _parse_products(
-        self, data: dict[str, dict[str, Any]]
-    ) -> Generator[MenuProduct]:
+    def _parse_products(self, data: dict[str, dict[str, Any]]) -> list[MenuProduct]:
+        parsed: list[MenuProduct] = []
         for code, product in data.items():
-            if not {"Code", "Name", "ProductType", "Description", "Variants"}.issubset(
-                product.keys()
-            ):
-                logger.error("Incorrect product format", raw_data=product)
-                return
-
-            name = product.get("Name", "")
-            description = product.get("Description", "")
-            variants = product.get("Variants", [])
-            yield MenuProduct(
-                code=code, name=name, description=description, variants=set(variants)
+            try:
+                name = product["Name"]
+                description = product["Description"]
+                variants = product["Variants"]
+            except KeyError:
+                _get_logger().error("Incorrect product format", code=code)
+                return parsed
+
+            parsed.append(
+                MenuProduct(
+                    code=code,
+                    name=name,
+                    description=description,
+                    variants=frozenset(variants),
+                )
             )
+        return parsed
 
-    def _parse_line_items(self, data: dict[str, Any]) -> Generator[MenuLineItem]:
+    def _parse_line_items(self, data: dict[str, Any]) -> list[MenuLineItem]:
+        parsed: list[MenuLineItem] = []
         for code, variant in data.items():
-            if not {"Code", "Name", "Price", "SizeCode", "ProductCode"}.issubset(
-                variant.keys()
-            ):
-                logger.error("Incorrect variant format", data=(code, variant))
-                return
-
-            name = variant.get("Name", "")
-            product_code = variant.get("ProductCode", "")
+            try:
+                name = variant["Name"]
+                product_code = variant["ProductCode"]
+                raw_price = variant["Price"]
+            except KeyError:
+                _get_logger().error("Incorrect variant format", code=code)
+                return parsed
 
             try:
-                price = float(variant.get("Price", 0.0))
+                price = float(raw_price)
             except ValueError:
-                logger.error(
-                    "Failed to parse price for line item", raw_line_item=variant
+                _get_logger().error(
+                    "Failed to parse price for line item", code=code, price=raw_price
                 )
-                return
-            yield MenuLineItem(code, name, product_code, price)
+                return parsed
+            parsed.append(MenuLineItem(code, name, product_code, price))
+        return parsed
 
-    def _parse_coupons(self, data: dict[str, Any]) -> Generator[MenuCoupon]:
+    def _parse_coupons(self, data: dict[str, Any]) -> list[MenuCoupon]:
+        parsed: list[MenuCoupon] = []
         for code, coupon in data.items():
-            if not {"Code", "Name", "Price"}.issubset(coupon.keys()):
-                logger.error("Incorrect coupon format", data=coupon)
-                return
-            name = coupon.get("Name", "")
-            price = coupon.get("Price", "")
-            if price and not re.search(r"\$\d{1,2}\.\d{2}", name):
+            try:
+                name = coupon["Name"]
+                price = coupon["Price"]
+            except KeyError:
+                _get_logger().error("Incorrect coupon format", code=code)
+                return parsed
+            if price and not ("$" in name and _PRICE_RE.search(name)):
                 name += f" ${price}"
 
-            yield MenuCoupon(code, name)
+            parsed.append(MenuCoupon(code, name))
+        return parsed
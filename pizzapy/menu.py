@@ -1,24 +1,23 @@
-from collections.abc import Sequence, Set
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class MenuCategory:
     code: str
     name: str
     description: str
-    products: Set[str]
+    products: frozenset[str]
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class MenuProduct:
     code: str
     name: str
     description: str
-    variants: Set[str]
+    variants: frozenset[str]
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class MenuLineItem:
     code: str
     name: str
@@ -26,18 +25,18 @@ class MenuLineItem:
     price: float
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class MenuCoupon:
     code: str
     name: str
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Menu:
-    categories: Sequence[MenuCategory]
-    products: Sequence[MenuProduct]
-    line_items: Sequence[MenuLineItem]
-    coupons: Sequence[MenuCoupon]
+    categories: tuple[MenuCategory, ...]
+    products: tuple[MenuProduct, ...]
+    line_items: tuple[MenuLineItem, ...]
+    coupons: tuple[MenuCoupon, ...]
 
 
 # class Menu(object):
@@ -11,7 +11,7 @@ class PickupType(Enum):
     CARRYOUT = "Carryout"
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Store:
     """Representation of a Domino's store"""
 